@@ -0,0 +1,363 @@
+# coding=utf-8
+import collections
+import copy
+import logging
+import operator
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+NegativeCacheStats = collections.namedtuple("NegativeCacheStats", (
+    "hits", "misses", "stores", "evictions", "expirations", "size",
+))
+
+
+class NegativeCache(object):
+    """
+    Remembers lookups that failed upstream so the same miss is not requested again until `ttl_seconds` have
+    passed. A copy of the exception raised by the original request is stored, and every hit raises a fresh copy
+    of it, so callers cannot tell a cached miss from a fresh one apart from the missing round-trip and no
+    caller's traceback or context ends up in the cache.
+
+    Entries are kept in least recently used order and the oldest are evicted once `max_size` is reached. A
+    `max_size` or `ttl_seconds` of 0 disables the cache.
+    """
+
+    def __init__(self, ttl_seconds=300, max_size=10000, clock=time.monotonic):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self._clock = clock
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._stores = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    @property
+    def enabled(self):
+        return self.ttl_seconds > 0 and self.max_size > 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self._lookup(key) is not None
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, exc = entry
+            if expires_at > self._clock():
+                self._entries.move_to_end(key)
+                return exc
+            del self._entries[key]
+            self._expirations += 1
+            return None
+
+    def raise_if_cached(self, *keys):
+        """
+        Raises a copy of the stored exception for the first of `keys` that has a live entry. Every call that raises
+        is one upstream request avoided and is counted as a hit; a call that finds nothing counts as one miss.
+        """
+        if not self.enabled:
+            return
+        for key in keys:
+            exc = self._lookup(key)
+            if exc is not None:
+                with self._lock:
+                    self._hits += 1
+                logger.debug("Negative cache hit for %s", key)
+                # A new object per hit, Python attaches the traceback and context of this raise to it
+                raise copy.copy(exc)
+        with self._lock:
+            self._misses += 1
+
+    def add(self, key, exc):
+        if not self.enabled:
+            return
+        # The copy leaves the traceback, cause and context of the original raise behind
+        exc = copy.copy(exc)
+        with self._lock:
+            self._entries[key] = (self._clock() + self.ttl_seconds, exc)
+            self._entries.move_to_end(key)
+            self._stores += 1
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    @property
+    def stats(self):
+        """
+        A snapshot of the counters. `hits` is the number of upstream calls avoided.
+        """
+        with self._lock:
+            return NegativeCacheStats(self._hits, self._misses, self._stores, self._evictions, self._expirations,
+                                      len(self._entries))
+
+    def reset_stats(self):
+        with self._lock:
+            self._hits = self._misses = self._stores = self._evictions = self._expirations = 0
+
+
+ResponseCacheStats = collections.namedtuple("ResponseCacheStats", (
+    "hits", "stale_hits", "misses", "refreshes", "refresh_errors", "evictions", "size",
+))
+
+
+class _Entry(object):
+    __slots__ = ("value", "loader", "weight", "stored_at", "accesses")
+
+    def __init__(self, value, loader, weight, stored_at):
+        self.value = value
+        self.loader = loader
+        self.weight = weight
+        self.stored_at = stored_at
+        self.accesses = 0
+
+
+class BackgroundRefresher(object):
+    """
+    A single daemon thread that runs refresh jobs in the order they were submitted. A key that is already
+    waiting or running is not queued twice.
+    """
+
+    def __init__(self, name="bandsintao-refresher"):
+        self.name = name
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, key, job):
+        with self._lock:
+            if key in self._pending:
+                return False
+            self._pending.add(key)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+        self._queue.put((key, job))
+        return True
+
+    def join(self):
+        """
+        Blocks until every submitted job has finished.
+        """
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            key, job = self._queue.get()
+            try:
+                job()
+            except Exception:
+                logger.exception("Background refresh of %s failed", key)
+            finally:
+                with self._lock:
+                    self._pending.discard(key)
+                self._queue.task_done()
+
+
+class ResponseCache(object):
+    """
+    Caches API payloads for `ttl_seconds`. With `stale_seconds` set, an entry that expired less than
+    `stale_seconds` ago is still returned straight away while a `BackgroundRefresher` loads a fresh copy
+    (stale-while-revalidate). Older entries are dropped and loaded in the foreground.
+
+    Every entry keeps the loader that produced it, an access count and a weight, which `hottest` uses to pick
+    the entries worth refreshing before they expire, see `RefreshScheduler`. A `ttl_seconds` or `max_size`
+    of 0 disables the cache and every call goes straight to the loader.
+    """
+
+    def __init__(self, ttl_seconds=600, stale_seconds=0, max_size=10000, clock=time.monotonic, refresher=None):
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.max_size = max_size
+        self.refresher = refresher or BackgroundRefresher()
+        self._clock = clock
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._stale_hits = 0
+        self._misses = 0
+        self._refreshes = 0
+        self._refresh_errors = 0
+        self._evictions = 0
+
+    @property
+    def enabled(self):
+        return self.ttl_seconds > 0 and self.max_size > 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and self._clock() - entry.stored_at < self.ttl_seconds + self.stale_seconds
+
+    def get_or_load(self, key, loader, weight=None):
+        """
+        Returns the cached value for `key`, calling `loader()` when there is none.
+        :param key: Any hashable value
+        :param loader: Called without arguments to load the value, now and on every refresh
+        :param weight: Optional callable returning how valuable the loaded value is to keep fresh
+        :return:
+        """
+        if not self.enabled:
+            return loader()
+
+        stale = False
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                age = self._clock() - entry.stored_at
+                if age < self.ttl_seconds:
+                    self._hits += 1
+                elif age < self.ttl_seconds + self.stale_seconds:
+                    self._stale_hits += 1
+                    stale = True
+                else:
+                    del self._entries[key]
+                    entry = None
+            if entry is not None:
+                entry.accesses += 1
+                self._entries.move_to_end(key)
+                value = entry.value
+            else:
+                self._misses += 1
+
+        if entry is None:
+            value = loader()
+            self._store(key, value, loader, weight)
+        elif stale:
+            self.schedule_refresh(key)
+        return value
+
+    def _store(self, key, value, loader, weight, accesses=1):
+        entry = _Entry(value, loader, weight, self._clock())
+        entry.accesses = accesses
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def schedule_refresh(self, key):
+        return self.refresher.submit(key, lambda: self.refresh(key))
+
+    def refresh(self, key):
+        """
+        Reloads `key` with the loader that produced it. A failed refresh leaves the current entry in place.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return
+        try:
+            value = entry.loader()
+        except Exception:
+            with self._lock:
+                self._refresh_errors += 1
+            logger.warning("Refreshing %s failed, keeping the cached value", key, exc_info=True)
+            return
+        with self._lock:
+            self._refreshes += 1
+        # Halve the access count so popularity decays unless the entry keeps being read
+        self._store(key, value, entry.loader, entry.weight, accesses=entry.accesses // 2)
+
+    def hottest(self, limit, refresh_ahead_seconds):
+        """
+        Returns up to `limit` keys that expire within `refresh_ahead_seconds` (or are already stale), ordered
+        by their access count multiplied by their weight. Entries that were never read are skipped.
+        """
+        now = self._clock()
+        candidates = []
+        with self._lock:
+            for key, entry in self._entries.items():
+                age = now - entry.stored_at
+                if entry.accesses and self.ttl_seconds - refresh_ahead_seconds <= age \
+                        < self.ttl_seconds + self.stale_seconds:
+                    candidates.append((key, entry))
+        scored = []
+        for key, entry in candidates:
+            weight = entry.weight(entry.value) if entry.weight else 1
+            scored.append((entry.accesses * weight, key))
+        scored.sort(key=operator.itemgetter(0), reverse=True)
+        return [key for _, key in scored[:limit]]
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    @property
+    def stats(self):
+        with self._lock:
+            return ResponseCacheStats(self._hits, self._stale_hits, self._misses, self._refreshes,
+                                      self._refresh_errors, self._evictions, len(self._entries))
+
+    def reset_stats(self):
+        with self._lock:
+            self._hits = self._stale_hits = self._misses = 0
+            self._refreshes = self._refresh_errors = self._evictions = 0
+
+
+class RefreshScheduler(object):
+    """
+    Proactively refreshes the hottest entries of a `ResponseCache` before they expire. Every
+    `interval_seconds` at most `budget` entries, i.e. upstream requests, are handed to the cache's refresher.
+    """
+
+    def __init__(self, response_cache, budget=10, interval_seconds=60, refresh_ahead_seconds=None):
+        self.response_cache = response_cache
+        self.budget = budget
+        self.interval_seconds = interval_seconds
+        self.refresh_ahead_seconds = interval_seconds if refresh_ahead_seconds is None else refresh_ahead_seconds
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def run_once(self):
+        keys = self.response_cache.hottest(self.budget, self.refresh_ahead_seconds)
+        scheduled = [key for key in keys if self.response_cache.schedule_refresh(key)]
+        if scheduled:
+            logger.debug("Scheduled %s cache refreshes", len(scheduled))
+        return scheduled
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="bandsintao-refresh-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped.wait(self.interval_seconds):
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("Scheduling cache refreshes failed")
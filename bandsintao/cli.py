@@ -0,0 +1,264 @@
+# coding=utf-8
+"""
+Fetches artists, and optionally their events, in bulk and writes one JSON document per line:
+
+    bandsintao --app-id my-app-id --workers 16 --checkpoint crawl.checkpoint artists.txt -o artists.ndjson
+
+Every line of the input is an artist name, or with --ids a Bandsintown artist id, or with --fb-lookup a Facebook
+page id. With --checkpoint, finished lookups are recorded and skipped when the same command is run again, so an
+interrupted crawl resumes where it stopped. A lookup is recorded right after its line has been written, which
+means a crash in between can repeat at most the lines that were in flight.
+"""
+import argparse
+import collections
+import concurrent.futures
+import logging
+import os
+import sys
+import threading
+import time
+
+import requests
+
+from . import jjson
+from .client import (
+    ApiError,
+    Client,
+)
+
+logger = logging.getLogger(__name__)
+
+BulkSummary = collections.namedtuple("BulkSummary", (
+    "fetched", "not_found", "failed", "skipped", "events", "requests", "elapsed_seconds",
+))
+
+
+class Checkpoint(object):
+    """
+    An append-only file with one finished lookup per line. Every line is flushed as soon as it is written, so
+    it survives the process being killed; it is only fsynced every `sync_every` lines.
+    """
+
+    def __init__(self, path, sync_every=100):
+        self.path = path
+        self.sync_every = sync_every
+        self.done = set()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as fh:
+                self.done.update(line.rstrip("\n") for line in fh if line.strip())
+        self._fh = open(path, "a", encoding="utf-8")
+        self._unsynced = 0
+
+    def __contains__(self, key):
+        return key in self.done
+
+    def __len__(self):
+        return len(self.done)
+
+    def mark(self, key):
+        self.done.add(key)
+        self._fh.write(key + "\n")
+        self._fh.flush()
+        self._unsynced += 1
+        if self._unsynced >= self.sync_every:
+            self.sync()
+
+    def sync(self):
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+        self._unsynced = 0
+
+    def close(self):
+        self.sync()
+        self._fh.close()
+
+
+def _is_definitive(exc):
+    # Answers that won't change when asked again; anything else, e.g. a rejected app id or an outage's error page,
+    # is retried on the next run
+    if isinstance(exc, requests.exceptions.HTTPError):
+        return exc.response is not None and exc.response.status_code == requests.codes.not_found
+    return isinstance(exc, ApiError)
+
+
+def _plain(obj):
+    # Artist and Event keep helper attributes such as `_events` and the lazy `artists` in the dict itself
+    return {key: value for key, value in obj.items() if not key.startswith("_") and key != "artists"}
+
+
+class BulkFetcher(object):
+    """
+    Looks up a stream of artists with `workers` threads sharing one `Client` and writes every result to `output`
+    as soon as it is available. At most `workers * 4` lookups are queued at a time, so the input may be
+    arbitrarily large.
+    """
+
+    def __init__(self, client, output, workers=8, events=True, ids=False, fb_lookup=False, checkpoint=None):
+        self.client = client
+        self.output = output
+        self.workers = workers
+        self.events = events
+        self.ids = ids
+        self.fb_lookup = fb_lookup
+        self.checkpoint = checkpoint
+        self._lock = threading.Lock()
+        self._in_flight = set()
+        self._fetched = 0
+        self._not_found = 0
+        self._failed = 0
+        self._skipped = 0
+        self._events = 0
+
+    def _lookup_value(self, key):
+        if self.ids or self.fb_lookup:
+            return int(key)
+        return key
+
+    def fetch(self, key):
+        """
+        Returns the record written for `key`. When the artist is found but its events are definitively not, the
+        record has an `events_error` instead of `events`.
+        """
+        artist = self.client.Artist.load(self._lookup_value(key), fb_lookup=self.fb_lookup)
+        record = {"lookup": key, "artist": _plain(artist)}
+        if self.events:
+            try:
+                # Artists without upcoming events don't need the extra request
+                events = artist.events if artist.upcoming_event_count else []
+            except Exception as e:
+                if not _is_definitive(e):
+                    raise
+                # The artist was found, so it is written with the reason its events are missing
+                record["events_error"] = str(e)
+            else:
+                record["events"] = [_plain(event) for event in events]
+        return record
+
+    def _process(self, key):
+        try:
+            record = self.fetch(key)
+        except Exception as e:
+            if not _is_definitive(e):
+                logger.warning("Fetching %s failed, it will be retried on the next run: %s", key, e)
+                with self._lock:
+                    self._failed += 1
+                    self._in_flight.discard(key)
+                return
+            record = {"lookup": key, "error": str(e)}
+
+        line = jjson.dumps(record) + "\n"
+        with self._lock:
+            self.output.write(line)
+            self.output.flush()
+            if self.checkpoint is not None:
+                self.checkpoint.mark(key)
+            if "error" in record:
+                self._not_found += 1
+            else:
+                self._fetched += 1
+                self._events += len(record.get("events", ()))
+            self._in_flight.discard(key)
+
+    def _finished(self, future, key, slots):
+        slots.release()
+        exc = future.exception()
+        if exc is not None:
+            # e.g. the output went away, the lookup isn't checkpointed and is retried on the next run
+            logger.error("Processing %s failed", key, exc_info=exc)
+            with self._lock:
+                self._failed += 1
+                self._in_flight.discard(key)
+
+    def _keys(self, lines):
+        for line in lines:
+            key = line.strip()
+            if not key or key.startswith("#"):
+                continue
+            if (self.ids or self.fb_lookup) and not key.isdigit():
+                logger.warning("Skipping \"%s\", expected a numeric id", key)
+                with self._lock:
+                    self._failed += 1
+                continue
+            with self._lock:
+                if key in self._in_flight or (self.checkpoint is not None and key in self.checkpoint):
+                    self._skipped += 1
+                    continue
+                self._in_flight.add(key)
+            yield key
+
+    def run(self, lines):
+        started = time.monotonic()
+        requests_before = self.client.metrics.requests
+        slots = threading.BoundedSemaphore(self.workers * 4)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for key in self._keys(lines):
+                slots.acquire()
+                future = executor.submit(self._process, key)
+                future.add_done_callback(lambda done, key=key: self._finished(done, key, slots))
+        return BulkSummary(self._fetched, self._not_found, self._failed, self._skipped, self._events,
+                           self.client.metrics.requests - requests_before, time.monotonic() - started)
+
+
+def format_summary(summary):
+    elapsed = max(summary.elapsed_seconds, 1e-9)
+    done = summary.fetched + summary.not_found
+    return ("{s.fetched} artists and {s.events} events fetched, {s.not_found} not found, {s.failed} failed, "
+            "{s.skipped} skipped in {s.elapsed_seconds:.1f}s ({rate:.1f} artists/s, {req_rate:.1f} requests/s)"
+            ).format(s=summary, rate=done / elapsed, req_rate=summary.requests / elapsed)
+
+
+def _parser():
+    parser = argparse.ArgumentParser(prog="bandsintao", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", nargs="?", default="-", help="File with one artist per line, - for stdin")
+    parser.add_argument("-o", "--output", default="-", help="NDJSON file to write, - for stdout")
+    parser.add_argument("--app-id", default=os.environ.get("BANDSINTOWN_APP_ID"),
+                        help="Defaults to the BANDSINTOWN_APP_ID environment variable")
+    parser.add_argument("--uri", help="Base uri of the API")
+    lookup = parser.add_mutually_exclusive_group()
+    lookup.add_argument("--ids", action="store_true", help="The input holds Bandsintown artist ids")
+    lookup.add_argument("--fb-lookup", action="store_true", help="The input holds Facebook page ids")
+    parser.add_argument("--no-events", dest="events", action="store_false", help="Only fetch the artists")
+    parser.add_argument("--workers", type=int, default=8, help="Concurrent requests (default: %(default)s)")
+    parser.add_argument("--rate-limit", type=float, default=10,
+                        help="Requests per second, 0 for no limit (default: %(default)s)")
+    parser.add_argument("--checkpoint", help="File recording finished lookups, to resume an interrupted run")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    return parser
+
+
+def main(argv=None):
+    parser = _parser()
+    args = parser.parse_args(argv)
+    if not args.app_id:
+        parser.error("--app-id or BANDSINTOWN_APP_ID is required")
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING, stream=sys.stderr)
+
+    checkpoint = source = output = client = None
+    try:
+        try:
+            checkpoint = Checkpoint(args.checkpoint) if args.checkpoint else None
+            # Append when resuming so the lines written before the interruption are kept
+            mode = "a" if checkpoint is not None and len(checkpoint) else "w"
+            source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+            output = sys.stdout if args.output == "-" else open(args.output, mode, encoding="utf-8")
+        except OSError as e:
+            parser.error("can't open '{}': {}".format(e.filename, e.strerror))
+        client = Client(args.app_id, uri=args.uri, pool_size=args.workers, rate_limit=args.rate_limit or None)
+        fetcher = BulkFetcher(client, output, workers=args.workers, events=args.events, ids=args.ids,
+                              fb_lookup=args.fb_lookup, checkpoint=checkpoint)
+        summary = fetcher.run(source)
+    finally:
+        if client is not None:
+            client.close()
+        if checkpoint is not None:
+            checkpoint.close()
+        if source not in (None, sys.stdin):
+            source.close()
+        if output not in (None, sys.stdout):
+            output.close()
+
+    print(format_summary(summary), file=sys.stderr)
+    return 1 if summary.failed else 0
@@ -1,8 +1,13 @@
 # coding=utf-8
+import collections
+import concurrent.futures
 import hashlib
 import logging
+import math
 import operator
 import socket
+import threading
+import time
 import urllib.parse
 
 # noinspection PyPackageRequirements
@@ -10,16 +15,54 @@ import requests
 import requests.adapters
 import requests_toolbelt.utils.dump as toolbelt
 
-from . import jjson
+from . import (
+    cache,
+    jjson,
+    latency,
+    ratelimit,
+)
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_BASE_URI = "https://rest.bandsintown.com"
+DEFAULT_VERSION = "3.0"
+DEFAULT_TIMEOUT_SECONDS = 30
+
+# Lookups of `/artists/{slug}` that Bandsintown could not answer, see `Artist.load`
+artist_negative_cache = cache.NegativeCache(ttl_seconds=300, max_size=10000)
+
+# Payloads of `Artist.load` and `Artist.events`, disabled until replaced with e.g.
+# `cache.ResponseCache(ttl_seconds=600, stale_seconds=300)`; pair it with a `cache.RefreshScheduler` to keep the
+# most requested artists fresh
+response_cache = cache.ResponseCache(ttl_seconds=0)
+
+# Set to a `latency.LatencyTracker` to size the timeouts of `polite_request` from the observed response times,
+# which hedging requires too
+latency_tracker = None
+
+# Set to a `latency.HedgePolicy` to hedge slow requests, see `polite_request`
+hedge_policy = None
+
+# Set to an `interning.EventInterner` to share venues and repeated values between parsed events
+event_interner = None
+
+
+class ApiError(ValueError):
+    """
+    Raised when the API answers with an `{"error": ...}` payload instead of the requested resource.
+    """
+    pass
+
 
 class ApiConfig(object):
+    """
+    Configuration of the default client used by the module level `send_request`, `Artist` and `Event`. Create a
+    `Client` instead to use several app ids or settings side by side.
+    """
     AppId = None
-    Version = "3.0"
+    Version = DEFAULT_VERSION
     Format = "json"
-    BaseUri = "https://rest.bandsintown.com"
+    BaseUri = DEFAULT_BASE_URI
     Debug = False
 
     @staticmethod
@@ -31,76 +74,294 @@ class ApiConfig(object):
         ApiConfig.Version = version or ApiConfig.Version
 
 
-def polite_request(url, timeout_seconds=30, max_retries=5, **params):
+def _send(url, timeout_seconds, max_retries, params, session=None):
+    if session is None:
+        with requests.Session() as session:
+            session.mount("http://", requests.adapters.HTTPAdapter(max_retries=max_retries))
+            session.mount("https://", requests.adapters.HTTPAdapter(max_retries=max_retries))
+            return _send(url, timeout_seconds, max_retries, params, session)
+
+    try:
+        logger.debug("Sending request url => %s with params => %s", url, params)
+        response = session.get(url=url, timeout=timeout_seconds, params=params)
+    except requests.exceptions.ConnectionError:
+        logger.exception("ConnectionError: A connection error occurred")
+        raise
+    except requests.exceptions.Timeout:
+        logger.exception("Timeout: The request timed out")
+        raise
+    except socket.timeout:
+        # We also have to catch socket timeouts due to the underlying urllib3 library:
+        # https://github.com/kennethreitz/requests/issues/1236
+        logger.exception("Socket timeout: The request timed out")
+        raise
+    except requests.exceptions.TooManyRedirects:
+        logger.exception("TooManyRedirects: The url => \"%s\" has too many redirects", url)
+        raise
+    except requests.exceptions.RequestException:
+        logger.exception("IO Error")
+        raise
+
+    return response
+
+
+def _timed_send(tracker, endpoint, url, timeout_seconds, max_retries, params, session):
+    started = time.monotonic()
+    if not tracker:
+        return _send(url, timeout_seconds, max_retries, params, session)
+    # Every attempt is recorded on its own, so hedging doesn't hide the real upstream latency
+    try:
+        response = _send(url, timeout_seconds, max_retries, params, session)
+    except (requests.exceptions.Timeout, socket.timeout):
+        # Count a timeout as taking the full timeout, otherwise a slowdown past a tight timeout would never be seen
+        # and the timeout could never grow back
+        tracker.record(endpoint, max(timeout_seconds, time.monotonic() - started))
+        raise
+    except Exception:
+        tracker.record(endpoint, time.monotonic() - started)
+        raise
+    tracker.record(endpoint, time.monotonic() - started)
+    return response
+
+
+def _hedged_send(policy, delay, send, hedge_send):
+    started = threading.Event()
+
+    def primary_send():
+        started.set()
+        return send()
+
+    primary = policy.executor.submit(primary_send)
+    # The delay counts from the moment the request goes out, not from when it was queued behind other attempts,
+    # otherwise a busy pool would hedge requests that were never slow
+    started.wait()
+    done, _ = concurrent.futures.wait([primary], timeout=delay)
+    if done or not policy.acquire():
+        return primary.result()
+
+    logger.debug("No response after %.3fs, hedging the request", delay)
+    hedge = policy.executor.submit(hedge_send)
+    pending = [primary, hedge]
+    error = None
+    while pending:
+        done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                if future is hedge:
+                    policy.record_win()
+                # An attempt that is still queued is dropped, one that is already on the wire runs to completion
+                for loser in pending:
+                    loser.cancel()
+                return future.result()
+            error = error or future.exception()
+    raise error
+
+
+def polite_request(url, timeout_seconds=None, max_retries=5, tracker=None, hedging=None, session=None, rate_limiter=None,
+                   **params):
     """
     Tries its hardest not to vomit all over your request. Has retries for the requests
     Session and a timeout for the request. The following exceptions are documented here:
     http://docs.python-requests.org/en/latest/user/quickstart/#errors-and-exceptions
+
+    The request is sent with `session` when one is given, otherwise with a new Session that is closed afterwards.
+    Every attempt, including a hedged duplicate, takes a token from `rate_limiter` when one is given; the first
+    attempt takes it on the calling thread before it is sent, so waiting for a token never counts as latency.
+
+    With a `tracker` (the module `latency_tracker` by default, which is None) response times are recorded per
+    endpoint, and without an explicit `timeout_seconds` the timeout is derived from them; otherwise it is
+    `DEFAULT_TIMEOUT_SECONDS`. With a `hedging` policy (the module `hedge_policy` by default, which is None) and
+    a tracker, a duplicate request is sent once the first one is slower than the endpoint's usual tail latency,
+    and the first response wins. Pass False for either to disable it regardless of the module default.
+    """
+    if tracker is None:
+        tracker = latency_tracker
+    if hedging is None:
+        hedging = hedge_policy
+    endpoint = latency.endpoint_key(url)
+    if timeout_seconds is None:
+        timeout_seconds = tracker.timeout_for(endpoint) if tracker else DEFAULT_TIMEOUT_SECONDS
+
+    def send():
+        return _timed_send(tracker, endpoint, url, timeout_seconds, max_retries, params, session)
+
+    def hedge_send():
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        return send()
+
+    delay = hedging.delay_for(tracker, endpoint) if hedging and tracker else None
+    if rate_limiter is not None:
+        rate_limiter.acquire()
+    if delay is None:
+        return send()
+    return _hedged_send(hedging, delay, send, hedge_send)
+
+
+ClientMetrics = collections.namedtuple("ClientMetrics", (
+    "requests", "errors", "negative_cache", "response_cache", "hedging",
+))
+
+
+class Client(object):
     """
-    with requests.Session() as session:
+    A Bandsintown API client that owns its configuration, connection pool, rate limit, caches and metrics, so
+    several app ids can be served from one process without sharing any state. `Artist` and `Event` operations
+    are bound to the client through its `Artist` and `Event` attributes:
+
+        client = Client("my-app-id", rate_limit=5)
+        artist = client.Artist.load("Metallica")
+        events = artist.events
+
+    The module level `send_request`, `Artist` and `Event` use `default_client`, which is configured through
+    `ApiConfig` and the module level caches.
+    """
+
+    def __init__(self, app_id, uri=None, version=None, debug=False, max_retries=5, pool_size=10, rate_limit=None,
+                 negative_cache=None, response_cache=None, latency_tracker=None, hedge_policy=None, interner=None):
+        if not app_id:
+            raise ValueError("app_id: Expected something but got \"{}\"".format(app_id))
+        self.app_id = app_id
+        self.base_uri = uri or DEFAULT_BASE_URI
+        self.version = version or DEFAULT_VERSION
+        self.format = "json"
+        self.debug = debug
+        self.max_retries = max_retries
+        self.rate_limiter = ratelimit.RateLimiter(rate_limit) if rate_limit else None
+        self.negative_cache = cache.NegativeCache() if negative_cache is None else negative_cache
+        self.response_cache = cache.ResponseCache(ttl_seconds=0) if response_cache is None else response_cache
+        self.latency_tracker = latency_tracker
+        self.hedge_policy = hedge_policy
+        self.interner = interner
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_size, max_retries=max_retries)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.Artist = type("Artist", (Artist,), {"_client": self})
+        self.Event = type("Event", (Event,), {"_client": self})
+        self._init_metrics()
+
+    def _init_metrics(self):
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._errors = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Closes the client's Session. The caches, tracker and hedge policy were passed in by the caller, who may
+        share them with other clients, and are left alone.
+        """
+        if self.session is not None:
+            self.session.close()
+
+    @property
+    def metrics(self):
+        with self._lock:
+            requests_sent, errors = self._requests, self._errors
+        hedging = self.hedge_policy.stats if self.hedge_policy else None
+        return ClientMetrics(requests_sent, errors, self.negative_cache.stats, self.response_cache.stats, hedging)
+
+    def send_request(self, url, expected_type, **params):
+        with self._lock:
+            self._requests += 1
         try:
-            session.mount("http://", requests.adapters.HTTPAdapter(max_retries=max_retries))
-            session.mount("https://", requests.adapters.HTTPAdapter(max_retries=max_retries))
-            logger.debug("Sending request url => %s with params => %s", url, params)
-            response = session.get(url=url, timeout=timeout_seconds, params=params)
-        except requests.exceptions.ConnectionError:
-            logger.exception("ConnectionError: A connection error occurred")
-            raise
-        except requests.exceptions.Timeout:
-            logger.exception("Timeout: The request timed out")
-            raise
-        except socket.timeout:
-            # We also have to catch socket timeouts due to the underlying urllib3 library:
-            # https://github.com/kennethreitz/requests/issues/1236
-            logger.exception("Socket timeout: The request timed out")
-            raise
-        except requests.exceptions.TooManyRedirects:
-            logger.exception("TooManyRedirects: The url => \"%s\" has too many redirects", url)
+            return self._send_request(url, expected_type, **params)
+        except Exception:
+            with self._lock:
+                self._errors += 1
             raise
-        except requests.exceptions.RequestException:
-            logger.exception("IO Error")
+
+    def _send_request(self, url, expected_type, **params):
+        defaults = {
+            "api_version": self.version,
+            "app_id": self.app_id,
+            "format": self.format,
+        }
+        params.update(defaults)
+        resolved_url = urllib.parse.urljoin(self.base_uri, url)
+        response = polite_request(resolved_url, max_retries=self.max_retries, tracker=self.latency_tracker or False,
+                                  hedging=self.hedge_policy or False, session=self.session,
+                                  rate_limiter=self.rate_limiter, **params)
+
+        # Ensure datetime objects may be decoded
+        try:
+            payload = jjson.loads(response.content)
+        except ValueError:
+            # Error pages, e.g. an empty 404 or a proxy's 503, aren't JSON; report the status rather than the body
+            response.raise_for_status()
             raise
 
-    return response
+        if self.debug and logger.isEnabledFor(logging.DEBUG):
+            data = toolbelt.dump_response(response)
+            data = data.decode("utf-8").strip().replace("\r\n", "\n")
+            boundary = "\n> \n"
+            index = data.rfind(boundary) + 4
+            raw = data[index:]
+            data = data[0:index]
+            raw = jjson.loads(raw)
+            logger.debug("\n%s\n%s\n", data, jjson.dumps(raw, sort_keys=True, indent=4))
+
+        response.raise_for_status()
+        if not isinstance(payload, expected_type):
+            message = "Error loading {} with params {}: response expected {} but was {}".format(url,
+                                                                                                params,
+                                                                                                expected_type,
+                                                                                                type(payload))
+            raise ValueError(message)
+        if "error" in payload:
+            raise ApiError("Error loading {} with params {}: {}".format(url, params, payload["error"]))
+
+        return payload
+
+
+class DefaultClient(Client):
+    """
+    The client behind the module level `send_request`, `Artist` and `Event`. It reads its configuration from
+    `ApiConfig` and uses the module level caches on every call, and sends every request on a new Session.
+    """
+    app_id = property(lambda self: ApiConfig.AppId)
+    base_uri = property(lambda self: ApiConfig.BaseUri)
+    version = property(lambda self: ApiConfig.Version)
+    format = property(lambda self: ApiConfig.Format)
+    debug = property(lambda self: ApiConfig.Debug)
+    negative_cache = property(lambda self: artist_negative_cache)
+    response_cache = property(lambda self: response_cache)
+    latency_tracker = property(lambda self: latency_tracker)
+    hedge_policy = property(lambda self: hedge_policy)
+    interner = property(lambda self: event_interner)
+
+    def __init__(self):
+        self.max_retries = 5
+        self.rate_limiter = None
+        self.session = None
+        self.Artist = Artist
+        self.Event = Event
+        self._init_metrics()
 
 
 def send_request(url, expected_type, **params):
-    defaults = {
-        "api_version": ApiConfig.Version,
-        "app_id": ApiConfig.AppId,
-        "format": ApiConfig.Format,
-    }
-    params.update(defaults)
-    resolved_url = urllib.parse.urljoin(ApiConfig.BaseUri, url)
-    response = polite_request(resolved_url, **params)
-
-    # Ensure datetime objects may be decoded
-    payload = jjson.loads(response.content)
-
-    if ApiConfig.Debug and logger.isEnabledFor(logging.DEBUG):
-        data = toolbelt.dump_response(response)
-        data = data.decode("utf-8").strip().replace("\r\n", "\n")
-        boundary = "\n> \n"
-        index = data.rfind(boundary) + 4
-        raw = data[index:]
-        data = data[0:index]
-        raw = jjson.loads(raw)
-        logger.debug("\n%s\n%s\n", data, jjson.dumps(raw, sort_keys=True, indent=4))
-
-    response.raise_for_status()
-    if not isinstance(payload, expected_type):
-        message = "Error loading {} with params {}: response expected {} but was {}".format(url,
-                                                                                            params,
-                                                                                            expected_type,
-                                                                                            type(payload))
-        raise ValueError(message)
-    if "error" in payload:
-        raise ValueError("Error loading {} with params {}: {}".format(url, params, payload["error"]))
-
-    return payload
+    return default_client.send_request(url, expected_type, **params)
+
+
+def _unbound(klass):
+    # The class a `Client` bound `klass` to, e.g. `Artist` for `Client.Artist`
+    while vars(klass).get("_client") is not None:
+        klass = klass.__bases__[0]
+    return klass
 
 
 class BaseApiObject(dict):
+    # The `Client` this class is bound to, None for the default client
+    _client = None
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         for key, value in kwargs.items():
@@ -122,6 +383,19 @@ class BaseApiObject(dict):
             return self[key]
         raise AttributeError
 
+    def __reduce__(self):
+        # Classes bound to a `Client` only exist on that client, so instances pickle as the plain class and are
+        # bound to the default client once unpickled
+        return _unbound(type(self)), (), None, None, iter(self.items())
+
+    def __copy__(self):
+        # A copy in the same process keeps its client
+        return type(self)(self)
+
+    @classmethod
+    def get_client(cls):
+        return cls._client or default_client
+
     @property
     def hash(self):
         m = hashlib.md5()
@@ -178,17 +452,27 @@ class Event(BaseApiObject):
     }]
     """
 
-    @staticmethod
-    def parse(data):
-        event = Event(**data)
-        event.artists = ArtistLoader(data.get("lineup", []))
+    @classmethod
+    def parse(cls, data):
+        client = cls.get_client()
+        interner = client.interner
+        if interner is not None:
+            data = interner.event(data)
+        event = cls(**data)
+        # Copy the lineup, `ArtistLoader` replaces its items in place and `data` may be a cached payload
+        event.artists = ArtistLoader(list(data.get("lineup", [])), loader_klass=client.Artist)
         venue = data.get("venue")
-        event.venue = Venue(**venue) if venue else None
+        if not venue:
+            event.venue = None
+        elif interner is not None:
+            event.venue = interner.venue(venue, Venue)
+        else:
+            event.venue = Venue(**venue)
         return event
 
-    @staticmethod
-    def parse_all(data):
-        events = [Event.parse(event) for event in data]
+    @classmethod
+    def parse_all(cls, data):
+        events = [cls.parse(event) for event in data]
         return events
 
     @staticmethod
@@ -211,20 +495,23 @@ class Event(BaseApiObject):
 
         return dict(filter(lambda __: __[0] or False, kwargs.items()))
 
-    @staticmethod
-    def search(artist_id=None, location=None, radius=None, date=None, page=None, per_page=None):
-        params = Event._generate_params(**locals())
-        return Event.parse_all(send_request("/events/search", list, **params))
+    @classmethod
+    def search(cls, artist_id=None, location=None, radius=None, date=None, page=None, per_page=None):
+        params = cls._generate_params(artist_id=artist_id, location=location, radius=radius, date=date, page=page,
+                                      per_page=per_page)
+        return cls.parse_all(cls.get_client().send_request("/events/search", list, **params))
 
-    @staticmethod
-    def recommended(artist_id=None, location=None, radius=None, date=None, only_recs=None, page=None, per_page=None):
+    @classmethod
+    def recommended(cls, artist_id=None, location=None, radius=None, date=None, only_recs=None, page=None,
+                    per_page=None):
         only_recs = only_recs and "true" or "false"
-        params = Event._generate_params(**locals())
-        return Event.parse_all(send_request("/events/recommended", list, **params))
+        params = cls._generate_params(artist_id=artist_id, location=location, radius=radius, date=date,
+                                      only_recs=only_recs, page=page, per_page=per_page)
+        return cls.parse_all(cls.get_client().send_request("/events/recommended", list, **params))
 
-    @staticmethod
-    def daily():
-        return Event.parse_all(send_request("/events/daily", list))
+    @classmethod
+    def daily(cls):
+        return cls.parse_all(cls.get_client().send_request("/events/daily", list))
 
 
 class Artist(BaseApiObject):
@@ -255,11 +542,29 @@ class Artist(BaseApiObject):
     @property
     def events(self):
         if not self._events:
-            data = send_request("/artists/{}/events".format(self.name), list, artist_id=self.id)
-            self._events = Event.parse_all(data)
+            client = self.get_client()
+            url = "/artists/{}/events".format(self.name)
+            # The cache keeps the loader and weight for the entry's lifetime, so they must not hold on to `self`
+            artist_id = self.id
+            popularity = Artist.popularity(self)
+            data = client.response_cache.get_or_load(
+                (url, artist_id),
+                lambda: client.send_request(url, list, artist_id=artist_id),
+                weight=lambda _: popularity,
+            )
+            self._events = client.Event.parse_all(data)
 
         return self._events
 
+    @staticmethod
+    def popularity(data):
+        """
+        How much keeping this artist fresh in the cache is worth, from its tracker and upcoming event counts.
+        """
+        tracker_count = data.get("tracker_count") or 0
+        upcoming_event_count = data.get("upcoming_event_count") or 0
+        return 1 + math.log10(1 + tracker_count) + math.log10(1 + upcoming_event_count)
+
     @staticmethod
     def _clean_slug(val, fb_lookup):
         if val and isinstance(val, str):
@@ -274,41 +579,69 @@ class Artist(BaseApiObject):
             val = f"id_{val}" if not fb_lookup else f"fbid_{val}"
         return val
 
-    @staticmethod
-    def load(lookup_val, fb_lookup=False, verify_id=None):
+    @classmethod
+    def load(cls, lookup_val, fb_lookup=False, verify_id=None):
         """
         Load the artist payload into a helper object for consumption. You may pass either the artist name, the
         numeric ID, or the Facebook page ID into the lookup_val parameter. Note: If you would like to perform
         an artist lookup by Facebook page ID, you must pass fb_lookup=True into this method.
 
         You may also pass the expected payload "id" into here for validation of artist payload returned.
+
+        Lookups that fail with a 404, an error payload or a `verify_id` mismatch are remembered by
+        the client's negative cache (`artist_negative_cache` for the default client) and raise the same exception
+        again without a request until the entry expires. Successful payloads are served from the client's
+        response cache when it is enabled.
         :param lookup_val:
         :param fb_lookup:
         :param verify_id:
         :return:
         """
-        slug = Artist._clean_slug(lookup_val, fb_lookup)
-        data = send_request("/artists/{}".format(slug), dict)
-
+        client = cls.get_client()
+        slug = cls._clean_slug(lookup_val, fb_lookup)
         if isinstance(verify_id, int):
             verify_id = str(verify_id)
+
+        client.negative_cache.raise_if_cached(slug, (slug, verify_id))
+        url = "/artists/{}".format(slug)
+        try:
+            data = client.response_cache.get_or_load(url, lambda: client.send_request(url, dict),
+                                                     weight=cls.popularity)
+        except requests.exceptions.HTTPError as e:
+            if e.response is not None and e.response.status_code == requests.codes.not_found:
+                client.negative_cache.add(slug, e)
+            raise
+        except ApiError as e:
+            client.negative_cache.add(slug, e)
+            raise
+
         if isinstance(verify_id, str) and data["id"] != verify_id:
-            raise ValueError("Wrong artist payload was returned, somehow")
+            e = ValueError("Wrong artist payload was returned, somehow")
+            client.negative_cache.add((slug, verify_id), e)
+            raise e
 
-        data["slug"] = slug
+        data = dict(data, slug=slug)
         data["upcoming_event_count"] = data.get("upcoming_event_count", 0)
-        return Artist(**data)
+        return cls(**data)
 
 
 class LazyLoader(object):
     loader_klass = None
 
-    def __init__(self, initial_data):
+    def __init__(self, initial_data, loader_klass=None):
+        if loader_klass is not None:
+            self.loader_klass = loader_klass
         if self.loader_klass is None:
             raise ValueError("You need to set the loader_klass")
 
         self._data = initial_data
 
+    def __getstate__(self):
+        state = dict(vars(self))
+        if "loader_klass" in state:
+            state["loader_klass"] = _unbound(state["loader_klass"])
+        return state
+
     def __len__(self):
         return len(self._data)
 
@@ -330,3 +663,6 @@ class LazyLoader(object):
 
 class ArtistLoader(LazyLoader):
     loader_klass = Artist
+
+
+default_client = DefaultClient()
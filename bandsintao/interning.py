@@ -0,0 +1,98 @@
+# coding=utf-8
+import collections
+import logging
+
+logger = logging.getLogger(__name__)
+
+InternerStats = collections.namedtuple("InternerStats", ("values", "venues", "value_hits", "venue_hits"))
+
+
+def _normalised(value):
+    return " ".join(value.split()).casefold() if isinstance(value, str) else value
+
+
+def _coordinate(value):
+    try:
+        return round(float(value), 4)
+    except (TypeError, ValueError):
+        return value.strip() if isinstance(value, str) else value
+
+
+class EventInterner(object):
+    """
+    Opt-in de-duplication of the repetitive parts of parsed events. Feeds repeat the same venues, places, offer
+    types and dates thousands of times; with an interner every distinct value is kept once and shared by all the
+    events that use it:
+
+    - Venues with the same normalised name, city, region, country and coordinates become a single `Venue`
+      instance, so changing one event's venue changes it for every event at that venue.
+    - The dictionary keys and the values of `INTERNED_FIELDS`, including the lineup names and datetimes,
+      become a single object per distinct value.
+
+    The interner keeps every value it has seen until `clear` is called, so it's meant to live as long as the
+    events it was used for, e.g. one per daily feed.
+    """
+    INTERNED_FIELDS = frozenset((
+        "artist_id", "datetime", "on_sale_datetime", "description", "city", "country", "region", "type", "status",
+    ))
+
+    def __init__(self):
+        self._values = {}
+        self._venues = {}
+        self._value_hits = 0
+        self._venue_hits = 0
+
+    def value(self, value):
+        # Equal isn't always interchangeable, e.g. True == 1 and the same instant in two timezones
+        key = (type(value), value, getattr(value, "tzinfo", None))
+        try:
+            interned = self._values.setdefault(key, value)
+        except TypeError:
+            # Unhashable, nothing to share
+            return value
+        if interned is not value:
+            self._value_hits += 1
+        return interned
+
+    def _fields(self, data):
+        return {
+            self.value(key): self.value(value) if key in self.INTERNED_FIELDS else value
+            for key, value in data.items()
+        }
+
+    def event(self, data):
+        """
+        Returns a copy of the event payload `data` that shares its repeated values with earlier events.
+        """
+        data = self._fields(data)
+        if "lineup" in data:
+            data["lineup"] = [self.value(name) for name in data["lineup"]]
+        if "offers" in data:
+            data["offers"] = [self._fields(offer) if isinstance(offer, dict) else offer for offer in data["offers"]]
+        return data
+
+    def venue(self, data, venue_klass):
+        """
+        Returns the `venue_klass` instance for the venue payload `data`, creating it the first time a venue is
+        seen. Venues without a name are never shared.
+        """
+        name = data.get("name")
+        if not isinstance(name, str) or not name.strip():
+            return venue_klass(**self._fields(data))
+        # The place tells apart venues that share a name when the payload has no coordinates
+        key = (_normalised(name), _normalised(data.get("city")), _normalised(data.get("region")),
+               _normalised(data.get("country")), _coordinate(data.get("latitude")), _coordinate(data.get("longitude")))
+        venue = self._venues.get(key)
+        if venue is None:
+            venue = self._venues.setdefault(key, venue_klass(**self._fields(data)))
+        else:
+            self._venue_hits += 1
+        return venue
+
+    @property
+    def stats(self):
+        return InternerStats(len(self._values), len(self._venues), self._value_hits, self._venue_hits)
+
+    def clear(self):
+        self._values.clear()
+        self._venues.clear()
@@ -0,0 +1,146 @@
+# coding=utf-8
+import collections
+import concurrent.futures
+import logging
+import math
+import re
+import threading
+import urllib.parse
+
+logger = logging.getLogger(__name__)
+
+LatencyStats = collections.namedtuple("LatencyStats", ("count", "p50", "p95", "p99"))
+HedgeStats = collections.namedtuple("HedgeStats", ("requests", "hedges", "hedge_wins", "hedges_denied"))
+
+_artist_path_regex = re.compile(r"^/artists/[^/]+")
+
+
+def endpoint_key(url):
+    """
+    Groups request urls by endpoint so latencies of different artists are tracked together, e.g.
+    `https://rest.bandsintown.com/artists/Metallica/events` => `/artists/{name}/events`.
+    """
+    path = urllib.parse.urlsplit(url).path or "/"
+    return _artist_path_regex.sub("/artists/{name}", path)
+
+
+def _percentile(ordered, pct):
+    # Nearest-rank percentile of an already sorted sequence
+    index = max(0, int(math.ceil(pct / 100.0 * len(ordered))) - 1)
+    return ordered[index]
+
+
+class LatencyTracker(object):
+    """
+    Keeps the last `window` response times per endpoint and derives request timeouts from them. Until an
+    endpoint has `min_samples` observations its timeout is `default_timeout`; afterwards it is the observed p99
+    times `multiplier`, clamped between `min_timeout` and `max_timeout`.
+    """
+
+    def __init__(self, window=500, min_samples=20, default_timeout=30, min_timeout=1, max_timeout=30, multiplier=3):
+        self.window = window
+        self.min_samples = min_samples
+        self.default_timeout = default_timeout
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.multiplier = multiplier
+        self._samples = collections.defaultdict(lambda: collections.deque(maxlen=self.window))
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, seconds):
+        with self._lock:
+            self._samples[endpoint].append(seconds)
+
+    def percentile(self, endpoint, pct):
+        """
+        Returns the `pct` percentile latency of `endpoint` in seconds, or None without enough samples.
+        """
+        with self._lock:
+            samples = self._samples.get(endpoint)
+            if not samples or len(samples) < self.min_samples:
+                return None
+            ordered = sorted(samples)
+        return _percentile(ordered, pct)
+
+    def timeout_for(self, endpoint):
+        p99 = self.percentile(endpoint, 99)
+        if p99 is None:
+            return self.default_timeout
+        return min(self.max_timeout, max(self.min_timeout, p99 * self.multiplier))
+
+    def stats(self, endpoint):
+        with self._lock:
+            ordered = sorted(self._samples.get(endpoint, ()))
+        if not ordered:
+            return LatencyStats(0, None, None, None)
+        return LatencyStats(len(ordered), _percentile(ordered, 50), _percentile(ordered, 95), _percentile(ordered, 99))
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+
+
+class HedgePolicy(object):
+    """
+    Decides when a duplicate ("hedged") request is sent. A request that has not answered after the observed
+    `percentile` latency of its endpoint is sent a second time and whichever response arrives first wins. At most
+    `max_ratio` of all requests may be hedged, which caps the extra load put on the API.
+    """
+
+    def __init__(self, percentile=95, max_ratio=0.1, min_delay=0.05, max_workers=32):
+        self.percentile = percentile
+        self.max_ratio = max_ratio
+        self.min_delay = min_delay
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._hedges = 0
+        self._hedge_wins = 0
+        self._hedges_denied = 0
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers,
+                                                                       thread_name_prefix="bandsintao-hedge")
+            return self._executor
+
+    def delay_for(self, tracker, endpoint):
+        """
+        Counts a request against `endpoint` and returns how long to wait before hedging it, or None when the
+        endpoint has too few samples to hedge on.
+        """
+        with self._lock:
+            self._requests += 1
+        delay = tracker.percentile(endpoint, self.percentile)
+        if delay is None:
+            return None
+        return max(self.min_delay, delay)
+
+    def acquire(self):
+        """
+        Returns True and counts a hedge if one more stays within `max_ratio` of all requests.
+        """
+        with self._lock:
+            if self._hedges + 1 > self._requests * self.max_ratio:
+                self._hedges_denied += 1
+                return False
+            self._hedges += 1
+            return True
+
+    def record_win(self):
+        with self._lock:
+            self._hedge_wins += 1
+
+    @property
+    def stats(self):
+        with self._lock:
+            return HedgeStats(self._requests, self._hedges, self._hedge_wins, self._hedges_denied)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
@@ -0,0 +1,42 @@
+# coding=utf-8
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter(object):
+    """
+    A token bucket that allows `rate` requests per second on average and bursts of up to `burst` requests.
+    `acquire` blocks the calling thread until a request may be sent.
+    """
+
+    def __init__(self, rate, burst=None, clock=time.monotonic, sleep=time.sleep):
+        if rate <= 0:
+            raise ValueError("rate: Expected a positive number but got \"{}\"".format(rate))
+        self.rate = float(rate)
+        self.burst = float(burst or max(1.0, rate))
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = self.burst
+        self._updated_at = clock()
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        # Takes a token, returning how long the caller has to wait before it may be used
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0
+            return -self._tokens / self.rate
+
+    def acquire(self):
+        wait = self._reserve()
+        if wait > 0:
+            logger.debug("Rate limited, waiting %.3fs", wait)
+            self._sleep(wait)
+        return wait
@@ -0,0 +1,93 @@
+# coding=utf-8
+"""
+Compares request latency with and without hedging against a local stub of the API that answers most requests
+quickly and a few of them very slowly.
+
+    python -m benchmarks.hedging --requests 500 --slow-ratio 0.02 --slow-ms 500
+
+Hedging after the p95 latency only pays off while fewer than 5% of the requests are slow, otherwise the p95 is
+itself a slow response and the hedge is sent too late to win.
+"""
+import argparse
+import http.server
+import logging
+import random
+import threading
+import time
+
+from bandsintao import (
+    client,
+    latency,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _make_handler(fast_ms, slow_ms, slow_ratio):
+    class StubHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if random.random() < slow_ratio:
+                delay = slow_ms
+            else:
+                delay = random.uniform(fast_ms / 2.0, fast_ms * 1.5)
+            time.sleep(delay / 1000.0)
+            body = b'{"id": "1", "name": "Stub"}'
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return StubHandler
+
+
+def _run(url, count, warmup, hedging):
+    tracker = latency.LatencyTracker()
+    for _ in range(warmup):
+        client.polite_request(url, tracker=tracker)
+
+    observed = []
+    for _ in range(count):
+        started = time.monotonic()
+        client.polite_request(url, tracker=tracker, hedging=hedging)
+        observed.append(time.monotonic() - started)
+    observed.sort()
+    return latency._percentile(observed, 50), latency._percentile(observed, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--warmup", type=int, default=100)
+    parser.add_argument("--fast-ms", type=float, default=20)
+    parser.add_argument("--slow-ms", type=float, default=500)
+    parser.add_argument("--slow-ratio", type=float, default=0.02)
+    parser.add_argument("--max-hedge-ratio", type=float, default=0.1)
+    args = parser.parse_args()
+
+    handler = _make_handler(args.fast_ms, args.slow_ms, args.slow_ratio)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = "http://127.0.0.1:{}/artists/Stub".format(server.server_address[1])
+
+    try:
+        p50, p99 = _run(url, args.requests, args.warmup, None)
+        print("plain:  p50 {:7.1f} ms  p99 {:7.1f} ms".format(p50 * 1000, p99 * 1000))
+
+        policy = latency.HedgePolicy(max_ratio=args.max_hedge_ratio)
+        hedged_p50, hedged_p99 = _run(url, args.requests, args.warmup, policy)
+        stats = policy.stats
+        print("hedged: p50 {:7.1f} ms  p99 {:7.1f} ms  ({} hedges, {} won, {} denied, {:.1%} extra requests)".format(
+            hedged_p50 * 1000, hedged_p99 * 1000, stats.hedges, stats.hedge_wins, stats.hedges_denied,
+            stats.hedges / float(stats.requests)))
+        print("change: p50 {:+.1%}  p99 {:+.1%}".format(hedged_p50 / p50 - 1, hedged_p99 / p99 - 1))
+        policy.shutdown()
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
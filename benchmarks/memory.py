@@ -0,0 +1,75 @@
+# coding=utf-8
+"""
+Measures the memory held by a large set of parsed events with and without an `EventInterner`. The feed is built
+from the upcoming events in tests/data, repeated as if every artist were requested again each day with new event
+ids, so venues, places and dates repeat the way they do in a real feed.
+
+    python -m benchmarks.memory --copies 100
+"""
+import argparse
+import gc
+import glob
+import logging
+import os
+import time
+import tracemalloc
+
+from bandsintao import jjson
+from bandsintao.client import Client
+from bandsintao.interning import EventInterner
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests", "data")
+
+
+def _pages(copies):
+    templates = []
+    for path in sorted(glob.glob(os.path.join(DATA_DIR, "*", "upcoming.json"))):
+        with open(path, encoding="utf-8") as fh:
+            templates.append(fh.read())
+    for copy in range(copies):
+        for template in templates:
+            # New event ids for every copy, everything else repeats
+            yield template.replace("\"id\": \"10", "\"id\": \"{}".format(copy))
+
+
+def _measure(copies, interner):
+    client = Client("benchmark", interner=interner)
+    pages = list(_pages(copies))
+    gc.collect()
+    objects_before = len(gc.get_objects())
+    tracemalloc.start()
+    started = time.monotonic()
+    events = []
+    for page in pages:
+        events.extend(client.Event.parse_all(jjson.loads(page)))
+    elapsed = time.monotonic() - started
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    tracked = len(gc.get_objects()) - objects_before
+    client.close()
+    return len(events), current, tracked, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--copies", type=int, default=100)
+    args = parser.parse_args()
+
+    results = []
+    for label, interner in (("plain", None), ("interned", EventInterner())):
+        count, current, tracked, elapsed = _measure(args.copies, interner)
+        results.append((current, tracked))
+        print("{:8} {} events: {:7.1f} MiB held, {:8} gc tracked objects, parsed in {:.2f}s".format(
+            label, count, current / 1024.0 / 1024.0, tracked, elapsed))
+        if interner is not None:
+            print("         {}".format(interner.stats))
+    (plain_memory, plain_tracked), (interned_memory, interned_tracked) = results
+    print("change:  memory {:+.1%}, gc tracked objects {:+.1%}".format(
+        interned_memory / plain_memory - 1, interned_tracked / plain_tracked - 1))
+
+
+if __name__ == "__main__":
+    main()
@@ -68,6 +68,11 @@ setup(
         "Topic :: Office/Business :: Scheduling",
         "Topic :: Other/Nonlisted Topic",
     ],
+    entry_points={
+        "console_scripts": [
+            "bandsintao = bandsintao.cli:main",
+        ],
+    },
     install_requires=requirements("default.txt"),
     test_suite="nose.collector",
     tests_require=requirements("test.txt"),
@@ -1,4 +1,18 @@
 # coding=utf-8
 import logging
 
+import mock
+import requests
+
 logger = logging.getLogger(__name__)
+
+
+def make_response(content, status_code=requests.codes.ok):
+    """
+    Builds the `requests` Response that a mocked `polite_request` returns for `content`.
+    """
+    response = requests.models.Response()
+    response._content = content.encode("utf-8")
+    response.status_code = status_code
+    response.request = mock.MagicMock(url="https://rest.bandsintown.com/artists/test")
+    return response
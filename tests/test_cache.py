@@ -0,0 +1,281 @@
+# coding=utf-8
+import gc
+import logging
+import unittest
+import weakref
+
+import mock
+import requests
+from requests import HTTPError
+
+from bandsintao import client
+from bandsintao.cache import (
+    NegativeCache,
+    RefreshScheduler,
+    ResponseCache,
+)
+from bandsintao.client import (
+    ApiConfig,
+    ApiError,
+    Artist,
+)
+from tests import make_response
+
+logger = logging.getLogger(__name__)
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class NegativeCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = NegativeCache(ttl_seconds=60, max_size=2, clock=self.clock)
+
+    def test_raises_stored_exception(self):
+        exc = ValueError("missing")
+        self.cache.add("slug", exc)
+        with self.assertRaises(ValueError) as ctx:
+            self.cache.raise_if_cached("slug")
+        self.assertIsNot(ctx.exception, exc)
+        self.assertEqual(ctx.exception.args, ("missing",))
+        self.assertEqual(self.cache.stats.hits, 1)
+
+    def test_hits_do_not_share_tracebacks(self):
+        self.cache.add("slug", ValueError("missing"))
+        raised = []
+        for _ in range(2):
+            try:
+                try:
+                    raise KeyError("unrelated")
+                except KeyError:
+                    self.cache.raise_if_cached("slug")
+            except ValueError as e:
+                raised.append(e)
+        self.assertIsNot(raised[0], raised[1])
+        self.assertIsInstance(raised[0].__context__, KeyError)
+        _, stored = self.cache._entries["slug"]
+        self.assertIsNone(stored.__context__)
+        self.assertIsNone(stored.__traceback__)
+
+    def test_http_errors_keep_their_response(self):
+        response = make_response("", status_code=requests.codes.not_found)
+        self.cache.add("slug", HTTPError("404 Client Error", response=response))
+        with self.assertRaises(HTTPError) as ctx:
+            self.cache.raise_if_cached("slug")
+        self.assertIs(ctx.exception.response, response)
+
+    def test_miss(self):
+        self.cache.raise_if_cached("slug")
+        self.assertEqual(self.cache.stats.misses, 1)
+        self.assertEqual(self.cache.stats.hits, 0)
+
+    def test_expiry(self):
+        self.cache.add("slug", ValueError("missing"))
+        self.clock.now += 61
+        self.cache.raise_if_cached("slug")
+        self.assertEqual(self.cache.stats.expirations, 1)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_bounded_size(self):
+        self.cache.add("a", ValueError("a"))
+        self.cache.add("b", ValueError("b"))
+        # Touch "a" so that "b" is the least recently used entry
+        self.assertIn("a", self.cache)
+        self.cache.add("c", ValueError("c"))
+        self.assertEqual(len(self.cache), 2)
+        self.assertNotIn("b", self.cache)
+        self.assertEqual(self.cache.stats.evictions, 1)
+
+    def test_disabled(self):
+        cache = NegativeCache(ttl_seconds=0)
+        cache.add("slug", ValueError("missing"))
+        cache.raise_if_cached("slug")
+        self.assertEqual(len(cache), 0)
+
+
+class ArtistNegativeCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        ApiConfig.init(app_id="testing")
+        client.artist_negative_cache.clear()
+        client.artist_negative_cache.reset_stats()
+
+    def tearDown(self):
+        ApiConfig.AppId = None
+        client.artist_negative_cache.clear()
+
+    def _load_twice(self, response, exc_type, **kwargs):
+        with mock.patch("bandsintao.client.polite_request") as mocked_polite_request:
+            mocked_polite_request.return_value = response
+            for _ in range(2):
+                with self.assertRaises(exc_type):
+                    Artist.load("Nobody", **kwargs)
+            self.assertEqual(mocked_polite_request.call_count, 1)
+        self.assertEqual(client.artist_negative_cache.stats.hits, 1)
+
+    def test_not_found(self):
+        self._load_twice(make_response("{}", status_code=requests.codes.not_found), HTTPError)
+
+    def test_not_found_without_json(self):
+        self._load_twice(make_response("", status_code=requests.codes.not_found), HTTPError)
+        client.artist_negative_cache.clear()
+        client.artist_negative_cache.reset_stats()
+        self._load_twice(make_response("<html>Not Found</html>", status_code=requests.codes.not_found), HTTPError)
+
+    def test_error_payload(self):
+        self._load_twice(make_response('{"error": "[NOT FOUND] The artist was not found"}'), ApiError)
+
+    def test_verify_id_mismatch(self):
+        self._load_twice(make_response('{"id": "1", "name": "Nobody"}'), ValueError, verify_id=2)
+
+    def test_verify_id_mismatch_is_scoped_to_verify_id(self):
+        response = make_response('{"id": "1", "name": "Nobody"}')
+        with mock.patch("bandsintao.client.polite_request") as mocked_polite_request:
+            mocked_polite_request.return_value = response
+            with self.assertRaises(ValueError):
+                Artist.load("Nobody", verify_id=2)
+            artist = Artist.load("Nobody", verify_id=1)
+            self.assertEqual(artist.id, "1")
+            self.assertEqual(mocked_polite_request.call_count, 2)
+
+    def test_server_errors_are_not_cached(self):
+        response = make_response("{}", status_code=requests.codes.service_unavailable)
+        with mock.patch("bandsintao.client.polite_request") as mocked_polite_request:
+            mocked_polite_request.return_value = response
+            for _ in range(2):
+                with self.assertRaises(HTTPError):
+                    Artist.load("Nobody")
+            self.assertEqual(mocked_polite_request.call_count, 2)
+
+
+class ResponseCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = ResponseCache(ttl_seconds=60, stale_seconds=30, max_size=10, clock=self.clock)
+        self.loads = 0
+
+    def loader(self):
+        self.loads += 1
+        return self.loads
+
+    def test_fresh_hit(self):
+        self.assertEqual(self.cache.get_or_load("key", self.loader), 1)
+        self.assertEqual(self.cache.get_or_load("key", self.loader), 1)
+        self.assertEqual(self.loads, 1)
+        self.assertEqual(self.cache.stats.hits, 1)
+
+    def test_stale_hit_refreshes_in_background(self):
+        self.cache.get_or_load("key", self.loader)
+        self.clock.now += 70
+        # The stale value is served immediately
+        self.assertEqual(self.cache.get_or_load("key", self.loader), 1)
+        self.cache.refresher.join()
+        self.assertEqual(self.cache.stats.stale_hits, 1)
+        self.assertEqual(self.cache.stats.refreshes, 1)
+        self.assertEqual(self.cache.get_or_load("key", self.loader), 2)
+
+    def test_expired_entry_is_loaded_in_foreground(self):
+        self.cache.get_or_load("key", self.loader)
+        self.clock.now += 91
+        self.assertEqual(self.cache.get_or_load("key", self.loader), 2)
+        self.assertEqual(self.cache.stats.misses, 2)
+
+    def test_contains_ignores_expired_entries(self):
+        self.cache.get_or_load("key", self.loader)
+        self.clock.now += 70
+        self.assertIn("key", self.cache)
+        self.clock.now += 21
+        self.assertNotIn("key", self.cache)
+
+    def test_failed_refresh_keeps_value(self):
+        def failing_loader():
+            raise ValueError("upstream is down")
+
+        self.cache.get_or_load("key", self.loader)
+        self.cache._entries["key"].loader = failing_loader
+        self.cache.refresh("key")
+        self.assertEqual(self.cache.stats.refresh_errors, 1)
+        self.assertEqual(self.cache.get_or_load("key", self.loader), 1)
+
+    def test_disabled(self):
+        cache = ResponseCache(ttl_seconds=0)
+        cache.get_or_load("key", self.loader)
+        cache.get_or_load("key", self.loader)
+        self.assertEqual(self.loads, 2)
+        self.assertEqual(len(cache), 0)
+
+
+class RefreshSchedulerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = ResponseCache(ttl_seconds=60, max_size=10, clock=self.clock)
+        self.scheduler = RefreshScheduler(self.cache, budget=2, interval_seconds=10)
+
+    def _add(self, key, accesses, tracker_count=0):
+        data = {"tracker_count": tracker_count}
+        self.cache.get_or_load(key, lambda: data, weight=Artist.popularity)
+        for _ in range(accesses - 1):
+            self.cache.get_or_load(key, lambda: data)
+
+    def test_refreshes_hottest_within_budget(self):
+        self._add("cold", accesses=1)
+        self._add("warm", accesses=5)
+        self._add("popular", accesses=1, tracker_count=10 ** 6)
+        self._add("hot", accesses=20)
+
+        # Nothing is about to expire yet
+        self.assertEqual(self.scheduler.run_once(), [])
+
+        self.clock.now += 55
+        self.assertEqual(self.scheduler.run_once(), ["hot", "popular"])
+        self.cache.refresher.join()
+        self.assertEqual(self.cache.stats.refreshes, 2)
+
+
+class ArtistResponseCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        ApiConfig.init(app_id="testing")
+        self.clock = FakeClock()
+        self._response_cache = client.response_cache
+        client.response_cache = ResponseCache(ttl_seconds=60, stale_seconds=30, clock=self.clock)
+
+    def tearDown(self):
+        ApiConfig.AppId = None
+        client.response_cache = self._response_cache
+
+    def test_load_and_events(self):
+        artist_response = make_response('{"id": "1", "name": "Somebody", "tracker_count": 10}')
+        events_response = make_response('[{"id": "2", "artist_id": "1", "lineup": ["Somebody"]}]')
+        with mock.patch("bandsintao.client.polite_request") as mocked_polite_request:
+            mocked_polite_request.return_value = artist_response
+            artist = Artist.load("Somebody")
+            self.assertEqual(Artist.load("Somebody", verify_id=1), artist)
+            self.assertEqual(mocked_polite_request.call_count, 1)
+
+            mocked_polite_request.return_value = events_response
+            self.assertEqual(len(artist.events), 1)
+            self.assertEqual(len(Artist.load("Somebody").events), 1)
+            self.assertEqual(mocked_polite_request.call_count, 2)
+
+            # Stale entries are served while the refresh happens in the background
+            self.clock.now += 70
+            mocked_polite_request.return_value = artist_response
+            Artist.load("Somebody")
+            client.response_cache.refresher.join()
+            self.assertEqual(mocked_polite_request.call_count, 3)
+
+    def test_events_entry_does_not_keep_artist_alive(self):
+        with mock.patch("bandsintao.client.polite_request") as mocked_polite_request:
+            mocked_polite_request.return_value = make_response('{"id": "1", "name": "Somebody"}')
+            artist = Artist.load("Somebody")
+            mocked_polite_request.return_value = make_response('[{"id": "2", "artist_id": "1", "lineup": []}]')
+            self.assertEqual(len(artist.events), 1)
+        reference = weakref.ref(artist)
+        del artist
+        gc.collect()
+        self.assertIsNone(reference())
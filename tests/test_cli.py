@@ -0,0 +1,128 @@
+# coding=utf-8
+import json
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+import requests
+
+from bandsintao import cli
+from bandsintao.client import Client
+from tests import make_response
+
+logger = logging.getLogger(__name__)
+
+
+def _polite_request(url, *args, **kwargs):
+    if url.endswith("/artists/Somebody"):
+        return make_response('{"id": "1", "name": "Somebody", "upcoming_event_count": 1}')
+    if url.endswith("/artists/Somebody/events"):
+        return make_response('[{"id": "2", "artist_id": "1", "datetime": "2018-09-04T19:30:00", '
+                             '"lineup": ["Somebody"], "venue": {"name": "Target Center"}}]')
+    if url.endswith("/artists/Quiet"):
+        return make_response('{"id": "3", "name": "Quiet", "upcoming_event_count": 0}')
+    if url.endswith("/artists/Outage"):
+        return make_response("<html><body>503 Service Unavailable</body></html>",
+                             status_code=requests.codes.service_unavailable)
+    if url.endswith("/artists/Gone"):
+        return make_response('{"id": "4", "name": "Gone", "upcoming_event_count": 1}')
+    if url.endswith("/artists/Unreachable"):
+        return make_response('{"id": "5", "name": "Unreachable", "upcoming_event_count": 1}')
+    if url.endswith("/artists/Gone/events"):
+        return make_response("<html><body>404 Not Found</body></html>", status_code=requests.codes.not_found)
+    if url.endswith("/artists/Nobody"):
+        return make_response('{"error": "[NOT FOUND] The artist was not found"}')
+    raise requests.exceptions.ConnectionError("refused")
+
+
+class CliTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.input = os.path.join(self.directory, "artists.txt")
+        self.output = os.path.join(self.directory, "artists.ndjson")
+        self.checkpoint = os.path.join(self.directory, "crawl.checkpoint")
+        with open(self.input, "w") as fh:
+            fh.write("# artists to crawl\nSomebody\nQuiet\n\nNobody\nFlaky\nOutage\nSomebody\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _run(self):
+        argv = [self.input, "-o", self.output, "--app-id", "testing", "--workers", "2", "--rate-limit", "0",
+                "--checkpoint", self.checkpoint]
+        with mock.patch("bandsintao.client.polite_request", side_effect=_polite_request) as mocked_polite_request:
+            code = cli.main(argv)
+        with open(self.output) as fh:
+            records = {record["lookup"]: record for record in map(json.loads, fh)}
+        return code, records, mocked_polite_request.call_count
+
+    def test_fetch_and_resume(self):
+        code, records, calls = self._run()
+        self.assertEqual(code, 1)
+        self.assertEqual(sorted(records), ["Nobody", "Quiet", "Somebody"])
+        self.assertEqual(records["Somebody"]["artist"]["name"], "Somebody")
+        self.assertEqual(records["Somebody"]["events"][0]["venue"], {"name": "Target Center"})
+        self.assertEqual(records["Somebody"]["events"][0]["datetime"], "2018-09-04T19:30:00")
+        self.assertEqual(records["Quiet"]["events"], [])
+        self.assertIn("NOT FOUND", records["Nobody"]["error"])
+        # Somebody twice, Quiet without its events, Nobody, Flaky and Outage
+        self.assertEqual(calls, 6)
+        with open(self.checkpoint) as fh:
+            self.assertEqual(sorted(fh.read().split()), ["Nobody", "Quiet", "Somebody"])
+
+        # Only the lookups that failed with a transient error are fetched again
+        code, records, calls = self._run()
+        self.assertEqual(code, 1)
+        self.assertEqual(sorted(records), ["Nobody", "Quiet", "Somebody"])
+        self.assertEqual(calls, 2)
+
+    def test_events_errors_keep_the_artist(self):
+        fetcher = cli.BulkFetcher(Client("testing"), mock.MagicMock())
+        with mock.patch("bandsintao.client.polite_request", side_effect=_polite_request):
+            record = fetcher.fetch("Gone")
+            self.assertEqual(record["artist"]["name"], "Gone")
+            self.assertIn("404", record["events_error"])
+            self.assertNotIn("events", record)
+            # Transient failures of the events fail the whole lookup, so it is retried
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                fetcher.fetch("Unreachable")
+
+    def test_unreadable_input_is_a_usage_error(self):
+        missing = os.path.join(self.directory, "missing.txt")
+        argv = [missing, "-o", self.output, "--app-id", "testing", "--checkpoint", self.checkpoint]
+        close = mock.patch.object(cli.Checkpoint, "close", autospec=True, side_effect=cli.Checkpoint.close)
+        with mock.patch("sys.stderr") as stderr, close as close:
+            with self.assertRaises(SystemExit) as ctx:
+                cli.main(argv)
+        self.assertEqual(ctx.exception.code, 2)
+        self.assertIn(missing, "".join(call[0][0] for call in stderr.write.call_args_list))
+        # The checkpoint was opened before the input and is closed again
+        self.assertEqual(close.call_count, 1)
+        self.assertFalse(os.path.exists(self.output))
+
+    def test_output_errors_are_counted(self):
+        output = mock.MagicMock()
+        output.write.side_effect = BrokenPipeError()
+        fetcher = cli.BulkFetcher(Client("testing"), output, workers=2, events=False)
+        with mock.patch("bandsintao.client.polite_request", side_effect=_polite_request):
+            summary = fetcher.run(["Somebody", "Quiet"])
+        fetcher.client.close()
+        self.assertEqual(summary.failed, 2)
+        self.assertEqual(summary.fetched, 0)
+
+    def test_checkpoint_is_flushed_on_every_mark(self):
+        checkpoint = cli.Checkpoint(self.checkpoint)
+        checkpoint.mark("Somebody")
+        with open(self.checkpoint) as fh:
+            self.assertEqual(fh.read(), "Somebody\n")
+        checkpoint.close()
+
+    def test_summary(self):
+        summary = cli.BulkSummary(fetched=8, not_found=2, failed=1, skipped=3, events=20, requests=18,
+                                  elapsed_seconds=2)
+        self.assertEqual(cli.format_summary(summary),
+                         "8 artists and 20 events fetched, 2 not found, 1 failed, 3 skipped in 2.0s "
+                         "(5.0 artists/s, 9.0 requests/s)")
@@ -0,0 +1,165 @@
+# coding=utf-8
+import copy
+import logging
+import pickle
+import threading
+import unittest
+
+import mock
+
+from bandsintao import client
+from bandsintao.cache import ResponseCache
+from bandsintao.client import (
+    ApiConfig,
+    Artist,
+    Client,
+    Event,
+)
+from bandsintao.latency import (
+    HedgePolicy,
+    LatencyTracker,
+)
+from bandsintao.ratelimit import RateLimiter
+from tests import make_response
+
+logger = logging.getLogger(__name__)
+
+
+class ClientTestCase(unittest.TestCase):
+    def setUp(self):
+        self.first = Client("first-app", response_cache=ResponseCache(ttl_seconds=60),
+                            latency_tracker=LatencyTracker())
+        self.second = Client("second-app", uri="https://example.com", version="3.1")
+
+    def tearDown(self):
+        self.first.close()
+        self.second.close()
+        ApiConfig.AppId = None
+
+    def test_requires_app_id(self):
+        with self.assertRaises(ValueError):
+            Client(None)
+
+    def test_configuration_is_per_client(self):
+        with mock.patch("bandsintao.client.polite_request") as mocked_polite_request:
+            mocked_polite_request.return_value = make_response('{"id": "1", "name": "Somebody"}')
+            self.first.Artist.load("Somebody")
+            self.second.Artist.load("Somebody")
+
+        (first_url,), first_kwargs = mocked_polite_request.call_args_list[0]
+        (second_url,), second_kwargs = mocked_polite_request.call_args_list[1]
+        self.assertEqual(first_url, "https://rest.bandsintown.com/artists/Somebody")
+        self.assertEqual(first_kwargs["app_id"], "first-app")
+        self.assertIs(first_kwargs["session"], self.first.session)
+        self.assertIs(first_kwargs["tracker"], self.first.latency_tracker)
+        self.assertEqual(second_url, "https://example.com/artists/Somebody")
+        self.assertEqual(second_kwargs["app_id"], "second-app")
+        self.assertEqual(second_kwargs["api_version"], "3.1")
+        self.assertIs(second_kwargs["session"], self.second.session)
+        self.assertIs(second_kwargs["tracker"], False)
+
+    def test_bound_objects(self):
+        artist_response = make_response('{"id": "1", "name": "Somebody"}')
+        events_response = make_response('[{"id": "2", "artist_id": "1", "lineup": ["Somebody"]}]')
+        with mock.patch("bandsintao.client.polite_request") as mocked_polite_request:
+            mocked_polite_request.return_value = artist_response
+            artist = self.first.Artist.load("Somebody")
+            self.assertIsInstance(artist, Artist)
+            self.assertIs(artist.get_client(), self.first)
+
+            mocked_polite_request.return_value = events_response
+            event = artist.events[0]
+            self.assertIsInstance(event, Event)
+            self.assertIs(event.get_client(), self.first)
+            self.assertIs(event.artists.loader_klass, self.first.Artist)
+
+    def test_bound_objects_pickle_as_plain_objects(self):
+        with mock.patch("bandsintao.client.polite_request") as mocked_polite_request:
+            mocked_polite_request.return_value = make_response('{"id": "1", "name": "Somebody"}')
+            artist = self.first.Artist.load("Somebody")
+            mocked_polite_request.return_value = make_response(
+                '[{"id": "2", "artist_id": "1", "lineup": ["Somebody"], "venue": {"name": "Somewhere"}}]')
+            artist.events
+
+        restored = pickle.loads(pickle.dumps(artist))
+        self.assertIs(type(restored), Artist)
+        self.assertIs(restored.get_client(), client.default_client)
+        self.assertEqual(restored.name, "Somebody")
+        event = restored.events[0]
+        self.assertIs(type(event), Event)
+        self.assertEqual(event.venue.name, "Somewhere")
+        self.assertIs(event.artists.loader_klass, Artist)
+        self.assertEqual(len(event.artists), 1)
+        self.assertIs(copy.copy(artist).get_client(), self.first)
+
+    def test_caches_and_metrics_are_per_client(self):
+        with mock.patch("bandsintao.client.polite_request") as mocked_polite_request:
+            mocked_polite_request.return_value = make_response('{"error": "[NOT FOUND] The artist was not found"}')
+            for _ in range(2):
+                with self.assertRaises(client.ApiError):
+                    self.first.Artist.load("Nobody")
+            with self.assertRaises(client.ApiError):
+                self.second.Artist.load("Nobody")
+            self.assertEqual(mocked_polite_request.call_count, 2)
+
+        self.assertEqual(self.first.metrics.requests, 1)
+        self.assertEqual(self.first.metrics.errors, 1)
+        self.assertEqual(self.first.metrics.negative_cache.hits, 1)
+        self.assertEqual(self.second.metrics.negative_cache.hits, 0)
+        self.assertNotIn("Nobody", client.artist_negative_cache)
+
+    def test_hedged_attempts_are_rate_limited(self):
+        tracker = LatencyTracker(min_samples=1)
+        tracker.record("/artists/{name}", 0.01)
+        policy = HedgePolicy(max_ratio=1, min_delay=0.01)
+        limiter = mock.MagicMock()
+        acquired_by = []
+        limiter.acquire.side_effect = lambda: acquired_by.append(threading.current_thread())
+        release = threading.Event()
+
+        def send(url, timeout_seconds, max_retries, params, session=None):
+            if limiter.acquire.call_count == 1:
+                release.wait(5)
+            release.set()
+            return make_response('{"id": "1", "name": "Somebody"}')
+
+        with Client("third-app", latency_tracker=tracker, hedge_policy=policy) as third:
+            third.rate_limiter = limiter
+            with mock.patch("bandsintao.client._send", side_effect=send):
+                third.Artist.load("Somebody")
+        self.assertEqual(policy.stats.hedges, 1)
+        self.assertEqual(limiter.acquire.call_count, 2)
+        # The first attempt waits for its token before it is handed to the pool, only the hedge waits in there
+        self.assertIs(acquired_by[0], threading.current_thread())
+        self.assertIsNot(acquired_by[1], threading.current_thread())
+        # The policy belongs to the caller and is still usable after the client was closed
+        self.assertEqual(policy.executor.submit(lambda: "ok").result(), "ok")
+        policy.shutdown()
+
+    def test_default_client_reads_api_config(self):
+        ApiConfig.init(app_id="testing")
+        with mock.patch("bandsintao.client.polite_request") as mocked_polite_request:
+            mocked_polite_request.return_value = make_response('{"id": "1", "name": "Somebody"}')
+            artist = Artist.load("Somebody")
+        self.assertIs(artist.get_client(), client.default_client)
+        self.assertEqual(mocked_polite_request.call_args[1]["app_id"], "testing")
+        self.assertIsNone(mocked_polite_request.call_args[1]["session"])
+
+
+class RateLimiterTestCase(unittest.TestCase):
+    def test_rate(self):
+        now = [0.0]
+        waits = []
+
+        def sleep(seconds):
+            waits.append(seconds)
+            now[0] += seconds
+
+        limiter = RateLimiter(2, burst=2, clock=lambda: now[0], sleep=sleep)
+        for _ in range(4):
+            limiter.acquire()
+        self.assertEqual(waits, [0.5, 0.5])
+
+    def test_invalid_rate(self):
+        with self.assertRaises(ValueError):
+            RateLimiter(0)
@@ -0,0 +1,78 @@
+# coding=utf-8
+import datetime
+import logging
+import os
+import unittest
+
+from bandsintao import (
+    client,
+    jjson,
+)
+from bandsintao.client import (
+    Client,
+    Event,
+    Venue,
+)
+from bandsintao.interning import EventInterner
+
+logger = logging.getLogger(__name__)
+
+
+def _load_events(slug):
+    with open(os.path.join(os.path.dirname(__file__), "data", slug, "upcoming.json")) as fh:
+        return jjson.loads(fh.read())
+
+
+class EventInternerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.interner = EventInterner()
+        self.client = Client("testing", interner=self.interner)
+
+    def tearDown(self):
+        self.client.close()
+
+    def test_venues_are_shared(self):
+        first = self.client.Event.parse_all(_load_events("Metallica"))
+        venue_hits = self.interner.stats.venue_hits
+        second = self.client.Event.parse_all(_load_events("Metallica"))
+        self.assertEqual([event.id for event in first], [event.id for event in second])
+        for a, b in zip(first, second):
+            self.assertIsNot(a, b)
+            self.assertIs(a.venue, b.venue)
+            self.assertIsInstance(a.venue, Venue)
+            self.assertIs(a.venue["country"], b.venue["country"])
+            for offer_a, offer_b in zip(a.offers, b.offers):
+                self.assertIs(offer_a["status"], offer_b["status"])
+            self.assertIs(a.datetime, b.datetime)
+            self.assertIs(a.lineup[0], b.lineup[0])
+        self.assertEqual(self.interner.stats.venue_hits - venue_hits, len(second))
+
+    def test_venue_key_is_normalised(self):
+        venue = {"name": "Target Center", "latitude": "44.979477", "longitude": "-93.276158"}
+        same = {"name": " target  center", "latitude": "44.97947701", "longitude": "-93.276158"}
+        other = {"name": "Target Center", "latitude": "40.816662", "longitude": "-96.732857"}
+        self.assertIs(self.interner.venue(venue, Venue), self.interner.venue(same, Venue))
+        self.assertIsNot(self.interner.venue(venue, Venue), self.interner.venue(other, Venue))
+        self.assertIsNot(self.interner.venue({}, Venue), self.interner.venue({}, Venue))
+
+    def test_venues_without_coordinates_are_told_apart_by_place(self):
+        san_francisco = {"name": "The Fillmore", "city": "San Francisco", "region": "CA", "country": "United States",
+                         "latitude": "", "longitude": ""}
+        philadelphia = dict(san_francisco, city="Philadelphia", region="PA")
+        self.assertIsNot(self.interner.venue(san_francisco, Venue), self.interner.venue(philadelphia, Venue))
+        self.assertEqual(self.interner.venue(philadelphia, Venue)["city"], "Philadelphia")
+        self.assertIs(self.interner.venue(san_francisco, Venue), self.interner.venue(dict(san_francisco), Venue))
+
+    def test_equal_values_of_other_types_are_kept_apart(self):
+        self.assertIs(self.interner.value(1), 1)
+        self.assertIs(self.interner.value(True), True)
+        utc = datetime.datetime(2018, 9, 4, 19, 30, tzinfo=datetime.timezone.utc)
+        shifted = utc.astimezone(datetime.timezone(datetime.timedelta(hours=2)))
+        self.assertIs(self.interner.value(utc), utc)
+        self.assertIs(self.interner.value(shifted), shifted)
+
+    def test_parse_without_interner(self):
+        self.assertIsNone(client.event_interner)
+        first = Event.parse_all(_load_events("Skrillex"))
+        second = Event.parse_all(_load_events("Skrillex"))
+        self.assertIsNot(first[0].venue, second[0].venue)
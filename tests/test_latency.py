@@ -0,0 +1,170 @@
+# coding=utf-8
+import logging
+import threading
+import time
+import unittest
+
+import mock
+import requests
+
+from bandsintao import client
+from bandsintao.latency import (
+    HedgePolicy,
+    LatencyTracker,
+    endpoint_key,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyTrackerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tracker = LatencyTracker(window=100, min_samples=10, default_timeout=30, min_timeout=1,
+                                      max_timeout=20, multiplier=3)
+
+    def test_endpoint_key(self):
+        self.assertEqual(endpoint_key("https://rest.bandsintown.com/artists/Metallica"), "/artists/{name}")
+        self.assertEqual(endpoint_key("https://rest.bandsintown.com/artists/id_128/events"), "/artists/{name}/events")
+        self.assertEqual(endpoint_key("https://rest.bandsintown.com/events/daily"), "/events/daily")
+
+    def test_default_timeout_without_samples(self):
+        self.tracker.record("/artists/{name}", 0.2)
+        self.assertIsNone(self.tracker.percentile("/artists/{name}", 50))
+        self.assertEqual(self.tracker.timeout_for("/artists/{name}"), 30)
+
+    def test_percentiles_and_timeout(self):
+        for i in range(1, 101):
+            self.tracker.record("/artists/{name}", i / 100.0)
+        stats = self.tracker.stats("/artists/{name}")
+        self.assertEqual(stats, (100, 0.5, 0.95, 0.99))
+        self.assertAlmostEqual(self.tracker.timeout_for("/artists/{name}"), 2.97)
+
+    def test_timeout_is_clamped(self):
+        for _ in range(10):
+            self.tracker.record("fast", 0.01)
+            self.tracker.record("slow", 10)
+        self.assertEqual(self.tracker.timeout_for("fast"), 1)
+        self.assertEqual(self.tracker.timeout_for("slow"), 20)
+
+    def test_window(self):
+        for _ in range(100):
+            self.tracker.record("/events/daily", 10)
+        for _ in range(100):
+            self.tracker.record("/events/daily", 0.1)
+        self.assertEqual(self.tracker.percentile("/events/daily", 99), 0.1)
+
+
+class HedgePolicyTestCase(unittest.TestCase):
+    def test_hedges_are_capped(self):
+        tracker = LatencyTracker(min_samples=1)
+        tracker.record("/artists/{name}", 0.2)
+        policy = HedgePolicy(max_ratio=0.1)
+        for _ in range(20):
+            self.assertEqual(policy.delay_for(tracker, "/artists/{name}"), 0.2)
+        self.assertTrue(policy.acquire())
+        self.assertTrue(policy.acquire())
+        self.assertFalse(policy.acquire())
+        self.assertEqual(policy.stats, (20, 2, 0, 1))
+
+
+class HedgedRequestTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tracker = LatencyTracker(min_samples=1)
+        self.tracker.record("/artists/{name}", 0.01)
+        self.policy = HedgePolicy(max_ratio=1, min_delay=0.01)
+
+    def tearDown(self):
+        self.policy.shutdown()
+
+    def test_hedge_wins(self):
+        calls = []
+        release = threading.Event()
+
+        def send(url, timeout_seconds, max_retries, params, session=None):
+            calls.append(url)
+            if len(calls) == 1:
+                # The first attempt stalls until the test has seen the hedged one win
+                release.wait(5)
+                return "slow"
+            return "fast"
+
+        with mock.patch("bandsintao.client._send", side_effect=send):
+            try:
+                response = client.polite_request("https://rest.bandsintown.com/artists/Metallica",
+                                                 tracker=self.tracker, hedging=self.policy)
+                self.assertEqual(response, "fast")
+                self.assertEqual(len(calls), 2)
+                self.assertEqual(self.policy.stats.hedge_wins, 1)
+            finally:
+                release.set()
+
+    def test_delay_starts_when_the_request_is_sent(self):
+        tracker = LatencyTracker(min_samples=1)
+        tracker.record("/artists/{name}", 0.05)
+        policy = HedgePolicy(max_ratio=1, min_delay=0.05, max_workers=2)
+        # Keep every worker busy for much longer than the hedging delay
+        for _ in range(2):
+            policy.executor.submit(time.sleep, 0.3)
+        try:
+            with mock.patch("bandsintao.client._send", return_value="fast") as mocked_send:
+                response = client.polite_request("https://rest.bandsintown.com/artists/Metallica", tracker=tracker,
+                                                 hedging=policy)
+        finally:
+            policy.shutdown()
+        self.assertEqual(response, "fast")
+        self.assertEqual(mocked_send.call_count, 1)
+        self.assertEqual(policy.stats.hedges, 0)
+
+    def test_fast_response_is_not_hedged(self):
+        self.tracker.record("/artists/{name}", 1)
+        with mock.patch("bandsintao.client._send", return_value="fast") as mocked_send:
+            response = client.polite_request("https://rest.bandsintown.com/artists/Metallica", tracker=self.tracker,
+                                             hedging=self.policy)
+        self.assertEqual(response, "fast")
+        self.assertEqual(mocked_send.call_count, 1)
+        self.assertEqual(self.policy.stats.hedges, 0)
+
+    def test_error_is_raised_when_every_attempt_fails(self):
+        def send(url, timeout_seconds, max_retries, params, session=None):
+            time.sleep(0.05)
+            raise requests.exceptions.ConnectionError("refused")
+
+        with mock.patch("bandsintao.client._send", side_effect=send) as mocked_send:
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                client.polite_request("https://rest.bandsintown.com/artists/Metallica", tracker=self.tracker,
+                                      hedging=self.policy)
+        self.assertEqual(mocked_send.call_count, 2)
+
+    def test_fixed_timeout_by_default(self):
+        self.assertIsNone(client.latency_tracker)
+        with mock.patch("bandsintao.client._send", return_value="ok") as mocked_send:
+            client.polite_request("https://rest.bandsintown.com/artists/Metallica")
+        self.assertEqual(mocked_send.call_args[0][1], client.DEFAULT_TIMEOUT_SECONDS)
+
+    def test_timeout_recovers_after_timeouts(self):
+        tracker = LatencyTracker(max_timeout=30)
+        for _ in range(50):
+            tracker.record("/artists/{name}", 0.2)
+        self.assertEqual(tracker.timeout_for("/artists/{name}"), 1)
+
+        timeouts = []
+        with mock.patch("bandsintao.client._send", side_effect=requests.exceptions.ReadTimeout) as mocked_send:
+            for _ in range(10):
+                with self.assertRaises(requests.exceptions.ReadTimeout):
+                    client.polite_request("https://rest.bandsintown.com/artists/Metallica", tracker=tracker)
+                timeouts.append(mocked_send.call_args[0][1])
+        self.assertEqual(timeouts, sorted(timeouts))
+        self.assertEqual(timeouts[0], 1)
+        self.assertEqual(timeouts[-1], 30)
+
+    def test_failures_are_recorded(self):
+        with mock.patch("bandsintao.client._send", side_effect=requests.exceptions.ConnectionError):
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                client.polite_request("https://rest.bandsintown.com/events/daily", tracker=self.tracker)
+        self.assertEqual(self.tracker.stats("/events/daily").count, 1)
+
+    def test_adaptive_timeout(self):
+        with mock.patch("bandsintao.client._send", return_value="ok") as mocked_send:
+            client.polite_request("https://rest.bandsintown.com/artists/Metallica", tracker=self.tracker)
+        timeout_seconds = mocked_send.call_args[0][1]
+        self.assertEqual(timeout_seconds, self.tracker.min_timeout)